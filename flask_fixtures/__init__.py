@@ -11,10 +11,15 @@
 """
 from __future__ import absolute_import
 
+import itertools
 import logging
 import os
+import random
 
-from sqlalchemy import Table
+import sqlalchemy
+import sqlalchemy.exc
+import sqlalchemy.orm
+from sqlalchemy import MetaData, Table
 
 from . import loaders
 from .utils import can_persist_fixtures
@@ -22,11 +27,11 @@ import six
 import importlib
 
 from flask import current_app
-from flask import _request_ctx_stack
+from flask import has_request_context
 try:
-    from flask import _app_ctx_stack
+    from flask import has_app_context
 except ImportError:
-    _app_ctx_stack = None
+    has_app_context = None
 
 try:
     import simplejson as json
@@ -47,7 +52,13 @@ CLASS_TEARDOWN_NAMES = ('tearDownClass', 'teardown_class', 'teardown_all', 'tear
 TEST_SETUP_NAMES = ('setUp',)
 TEST_TEARDOWN_NAMES = ('tearDown',)
 
-def push_ctx(app=None):
+# The contexts pushed by push_ctx, in the order they were pushed. Entries are
+# None when push_ctx reused a context that was already on the stack, so that
+# every call to push_ctx can be paired with a call to pop_ctx.
+_pushed_contexts = []
+
+
+def push_ctx(app=None, use_request_context=True):
     """Creates new test context(s) for the given app
 
     If the app is not None, it overrides any existing app and/or request
@@ -58,33 +69,44 @@ def push_ctx(app=None):
     context can be found, an AssertionError is emitted to let the user know
     that they must somehow specify an application for testing.
 
+    If `use_request_context` is False, only an app context is pushed, which
+    skips building the unused request environment for every test. Since an app
+    context carries no per-request state, an app context for the same app that
+    is already on the stack (e.g., one pushed for the whole class or session)
+    is reused rather than pushing another one on top of it. Versions of Flask
+    without app contexts (i.e., Flask < 0.9) always get a request context.
+
     """
+    ctx = None
     if app is not None:
-        ctx = app.test_request_context()
-        ctx.fixtures_request_context = True
-        ctx.push()
-        if _app_ctx_stack is not None:
-            _app_ctx_stack.top.fixtures_app_context = True
+        if not use_request_context and hasattr(app, 'app_context'):
+            if not (has_app_context() and current_app._get_current_object() is app):
+                ctx = app.app_context()
+        else:
+            ctx = app.test_request_context()
+        if ctx is not None:
+            ctx.push()
+    _pushed_contexts.append(ctx)
 
     # Make sure that we have an application in the current context
-    if (_app_ctx_stack is None or _app_ctx_stack.top is None) and _request_ctx_stack.top is None:
+    if not ((has_app_context is not None and has_app_context()) or has_request_context()):
+        _pushed_contexts.pop()
         raise AssertionError('A Flask application must be specified for Fixtures to work.')
 
 
 def pop_ctx():
-    """Removes the test context(s) from the current stack(s)
+    """Removes the test context(s) pushed by the matching call to push_ctx
     """
-    if getattr(_request_ctx_stack.top, 'fixtures_request_context', False):
-        _request_ctx_stack.pop()
-    if _app_ctx_stack is not None and getattr(_app_ctx_stack.top, 'fixtures_app_context', False):
-        _app_ctx_stack.pop()
+    ctx = _pushed_contexts.pop() if _pushed_contexts else None
+    if ctx is not None:
+        ctx.pop()
 
 
 def setup(obj):
     log.info('setting up fixtures...')
 
     # Push a request and/or app context onto the stack
-    push_ctx(getattr(obj, 'app'))
+    push_ctx(getattr(obj, 'app'), getattr(obj, 'use_request_context', True))
 
     # Setup the database
     obj.db.create_all()
@@ -102,9 +124,15 @@ def setup(obj):
             directory = os.path.abspath(os.path.join(current_app.root_path, directory))
         fixtures_dirs.append(directory)
 
+    # Parsed fixtures are cached in this directory, if one is given
+    cache_dir = current_app.config.get('FIXTURES_CACHE_DIR')
+    if cache_dir is not None and not os.path.isabs(cache_dir):
+        cache_dir = os.path.abspath(os.path.join(current_app.root_path, cache_dir))
+
     # Load all of the fixtures
-    for filename in obj.fixtures:
-        load_fixtures_from_file(obj.db, filename, fixtures_dirs)
+    defer_constraints = getattr(obj, 'defer_constraints', False)
+    for spec in obj.fixtures:
+        load_fixtures_from_file(obj.db, spec, fixtures_dirs, defer_constraints, cache_dir)
 
 
 def teardown(obj):
@@ -114,41 +142,388 @@ def teardown(obj):
     pop_ctx()
 
 
-def load_fixtures_from_file(db, fixture_filename, fixtures_dirs=[]):
+def load_fixtures_from_file(db, fixture_filename, fixtures_dirs=[], defer_constraints=False, cache_dir=None):
+    """Loads the fixtures in the given file into the database.
+
+    Instead of a filename, a fixture spec (see `select_fixtures`) may be given
+    to load only a subset of the records in the file. See `load_fixtures` for
+    `defer_constraints` and `loaders.load` for `cache_dir`.
+
+    """
+    spec = None
+    if isinstance(fixture_filename, dict):
+        spec = fixture_filename
+        validate_fixture_spec(spec)
+        fixture_filename = spec['file']
+
     fixtures_dirs = set(fixtures_dirs)
     fixtures_dirs.add('.')
     for directory in fixtures_dirs:
         filepath = os.path.join(directory, fixture_filename)
         if os.path.exists(filepath):
-            # TODO load the data into the database
-            load_fixtures(db, loaders.load(filepath))
+            fixtures = loaders.load(filepath, cache_dir)
+            if spec is not None:
+                fixtures = select_fixtures(fixtures, spec)
+            load_fixtures(db, fixtures, defer_constraints)
             break
     else:
         raise IOError("Error loading '{0}'. File could not be found".format(fixture_filename))
 
 
-def load_fixtures(db, fixtures):
+FIXTURE_SPEC_KEYS = ('file', 'model', 'table', 'where', 'limit', 'sample', 'seed')
+
+
+def validate_fixture_spec(spec):
+    """Raises a ValueError if the given fixture spec is invalid.
+    """
+    if 'file' not in spec:
+        raise ValueError("Fixture spec missing a 'file' field: {0}".format(spec))
+    unknown = set(spec) - set(FIXTURE_SPEC_KEYS)
+    if unknown:
+        raise ValueError("Unknown fixture spec field(s) {0}: {1}".format(', '.join(sorted(unknown)), spec))
+    if spec.get('limit') is not None and spec.get('sample') is not None:
+        raise ValueError("Fixture spec cannot have both a 'limit' and a 'sample': {0}".format(spec))
+
+
+def select_fixtures(fixtures, spec):
+    """Yields the fixtures and records selected by the given fixture spec.
+
+    A fixture spec is a dict that can be used in place of a filename in the
+    `fixtures` list of a test class. Besides the `file` to load, it may
+    contain any of the following keys:
+
+    - `model` / `table`: a name or list of names; only the fixtures for these
+      models and/or tables are loaded
+    - `where`: a function that takes a record and returns True if the record
+      should be loaded
+    - `limit`: the maximum number of records to load for each fixture
+    - `sample`: the number of records to pick at random for each fixture,
+      seeded with `seed` (defaults to 0) so the same records are always picked
+
+    Only one of `limit` and `sample` may be given. Records are filtered after
+    the file has been parsed and before anything is inserted, so the whole
+    file is still read into memory, but only the selected records reach the
+    database. Sampled records are kept in the order they appear in the file. The spec is validated (see
+    `validate_fixture_spec`) as soon as this function is called.
+
+    """
+    validate_fixture_spec(spec)
+    return _select_fixtures(fixtures, spec)
+
+
+def _select_fixtures(fixtures, spec):
+    def names(key):
+        value = spec.get(key)
+        if value is None or isinstance(value, (list, tuple, set)):
+            return value
+        return [value]
+
+    models, tables = names('model'), names('table')
+    where, limit, sample = spec.get('where'), spec.get('limit'), spec.get('sample')
+    rng = random.Random(spec.get('seed', 0))
+
+    for fixture in fixtures:
+        if models is not None or tables is not None:
+            if not (fixture.get('model') in (models or []) or fixture.get('table') in (tables or [])):
+                continue
+
+        records = fixture['records']
+        if where is not None:
+            records = (record for record in records if where(record))
+        if limit is not None:
+            records = itertools.islice(records, limit)
+        if sample is not None:
+            records = _sample_records(records, sample, rng)
+
+        selected = dict(fixture)
+        selected['records'] = list(records)
+        yield selected
+
+
+def _sample_records(records, size, rng):
+    """Returns a random sample of the records, keeping their original order.
+    """
+    # Reservoir sampling, so the records are sampled in a single pass
+    reservoir = []
+    for i, record in enumerate(records):
+        if i < size:
+            reservoir.append((i, record))
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                reservoir[j] = (i, record)
+    return [record for i, record in sorted(reservoir, key=lambda item: item[0])]
+
+
+def load_fixtures(db, fixtures, defer_constraints=False):
     """Loads the given fixtures into the database.
+
+    If `defer_constraints` is True, the non-primary key indexes of the tables
+    being loaded are dropped while the fixtures are inserted and rebuilt
+    afterwards, all in a single transaction, which is much faster for large
+    fixtures than updating the indexes row by row. On SQLite, foreign key
+    checks are also turned off during the inserts and run once at the end.
+    Foreign key violations found this way, and duplicates that keep a unique
+    index from being rebuilt, are raised as a ValueError and nothing is
+    loaded. On PostgreSQL, only constraints declared as DEFERRABLE are
+    deferred (SQLAlchemy's foreign keys aren't by default). Any others are
+    still checked row by row, and deferred ones are checked at commit, so
+    their violations are raised as an IntegrityError.
+
     """
+    if defer_constraints:
+        _load_fixtures_deferred(db, list(fixtures))
+        return
+
     conn = db.engine.connect()
-    metadata = db.metadata
+    max_keys = _max_keys_for(conn)
+    _insert_fixtures(db.metadata, conn, db.session, fixtures, db.session.commit, max_keys)
+    _sync_sequences(conn, max_keys)
+
+
+def _import_model(name):
+    """Returns the model class with the given fully-qualified name
+    """
+    module_name, class_name = name.rsplit('.', 1)
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)
+
+
+def _insert_fixtures(metadata, conn, session, fixtures, done, max_keys=None):
+    """Inserts the fixtures, calling `done` after the records of each model
 
+    If `max_keys` is a dict, it's updated with the largest explicit primary
+    key inserted into each table (see `_sync_sequences`).
+
+    """
     for fixture in fixtures:
         if 'model' in fixture:
-            module_name, class_name = fixture['model'].rsplit('.', 1)
-            module = importlib.import_module(module_name)
-            model = getattr(module, class_name)
+            model = _import_model(fixture['model'])
+            table = model.__table__
+            column = _primary_key(table) if max_keys is not None else None
+            if column is not None:
+                key = sqlalchemy.inspect(model).get_property_by_column(column).key
             for fields in fixture['records']:
+                if column is not None:
+                    _track_max_key(max_keys, table, fields.get(key))
                 obj = model(**fields)
-                db.session.add(obj)
-            db.session.commit()
+                session.add(obj)
+            done()
         elif 'table' in fixture:
             table = Table(fixture['table'], metadata)
-            conn.execute(table.insert(), fixture['records'])
+            records = list(fixture['records'])
+            column = _primary_key(table) if max_keys is not None else None
+            if column is not None:
+                for record in records:
+                    _track_max_key(max_keys, table, record.get(column.key))
+            conn.execute(table.insert(), records)
         else:
             raise ValueError("Fixture missing a 'model' or 'table' field: {0}".format(json.dumps(fixture)))
 
 
+def _primary_key(table):
+    """Returns the table's primary key column if it's a single integer column
+    """
+    columns = list(table.primary_key.columns)
+    if len(columns) == 1 and isinstance(columns[0].type, sqlalchemy.Integer):
+        return columns[0]
+    return None
+
+
+def _max_keys_for(conn):
+    """Returns a dict for tracking the largest keys inserted, if they're needed
+
+    Only PostgreSQL needs its sequences moved along after explicit primary
+    keys are inserted, so there's nothing to track (and no cost) elsewhere.
+
+    """
+    return {} if conn.dialect.name == 'postgresql' else None
+
+
+def _track_max_key(max_keys, table, value):
+    # Sequences can't be set below 1, and keys below 1 never collide with the
+    # values a sequence hands out anyway
+    if value is not None and value >= 1:
+        max_keys[table] = max(max_keys.get(table, value), value)
+
+
+def _sync_sequences(conn, max_keys):
+    """Moves the sequence of each table past the largest primary key inserted
+
+    All of the sequences are set with a single statement. A sequence is never
+    moved below the largest key already in its table, so loading a file with
+    smaller keys after one with larger keys doesn't move it backwards. Tables
+    whose primary key isn't backed by a sequence are skipped, since
+    PostgreSQL's setval returns NULL rather than failing when given a NULL
+    sequence name.
+
+    """
+    if not max_keys:
+        return
+
+    preparer = conn.dialect.identifier_preparer
+    calls = []
+    params = {}
+    for i, (table, value) in enumerate(max_keys.items()):
+        calls.append(
+            'setval(pg_get_serial_sequence(:table_{0}, :column_{0}), '
+            'GREATEST(:value_{0}, (SELECT COALESCE(MAX({1}), 0) FROM {2})))'.format(
+                i, preparer.format_column(_primary_key(table)), preparer.format_table(table)))
+        params['table_{0}'.format(i)] = preparer.format_table(table)
+        params['column_{0}'.format(i)] = _primary_key(table).name
+        params['value_{0}'.format(i)] = value
+    conn.execute(sqlalchemy.text('SELECT {0}'.format(', '.join(calls))), params)
+
+
+def _load_fixtures_deferred(db, fixtures):
+    """Loads the fixtures with constraint checks and indexes deferred until the end
+    """
+    tables = set()
+    for fixture in fixtures:
+        if 'model' in fixture:
+            tables.add(_import_model(fixture['model']).__table__)
+        elif fixture.get('table') in db.metadata.tables:
+            tables.add(db.metadata.tables[fixture['table']])
+    indexes = [index for table in tables for index in table.indexes]
+
+    conn = db.engine.connect()
+    dialect = conn.dialect.name
+    check_foreign_keys = False
+    try:
+        # SQLite ignores changes to foreign_keys inside of a transaction, so
+        # it has to be switched off before we start inserting anything
+        if dialect == 'sqlite':
+            with conn.begin():
+                check_foreign_keys = bool(conn.execute(sqlalchemy.text('PRAGMA foreign_keys')).scalar())
+                conn.execute(sqlalchemy.text('PRAGMA foreign_keys=OFF'))
+
+        try:
+            # The indexes are dropped and rebuilt in the same transaction as
+            # the inserts, so a violation found while rebuilding them rolls
+            # back the fixtures as well
+            with conn.begin():
+                if dialect == 'postgresql':
+                    # Only affects constraints declared as DEFERRABLE, the
+                    # rest are still checked as each row is inserted
+                    conn.execute(sqlalchemy.text('SET CONSTRAINTS ALL DEFERRED'))
+                for index in indexes:
+                    index.drop(bind=conn)
+
+                max_keys = _max_keys_for(conn)
+                session = sqlalchemy.orm.Session(bind=conn)
+                try:
+                    _insert_fixtures(db.metadata, conn, session, fixtures, session.flush, max_keys)
+                finally:
+                    session.close()
+                _sync_sequences(conn, max_keys)
+
+                if check_foreign_keys:
+                    violations = conn.execute(sqlalchemy.text('PRAGMA foreign_key_check')).fetchall()
+                    if violations:
+                        raise ValueError("Fixtures violate foreign key constraints: {0}".format('; '.join(
+                            "row {1} of '{0}' references a missing row in '{2}'".format(*v) for v in violations)))
+
+                # Rebuilding an index also checks any unique constraint it
+                # enforces. A failed statement aborts the whole transaction
+                # on PostgreSQL, so we can only report the first violation.
+                for index in indexes:
+                    try:
+                        index.create(bind=conn)
+                    except sqlalchemy.exc.IntegrityError as e:
+                        raise ValueError("Fixtures violate unique index '{0}' on '{1}': {2}".format(
+                            index.name, index.table.name, e.orig))
+        except Exception:
+            _restore_indexes(conn, indexes)
+            raise
+    finally:
+        try:
+            if check_foreign_keys:
+                with conn.begin():
+                    conn.execute(sqlalchemy.text('PRAGMA foreign_keys=ON'))
+        finally:
+            conn.close()
+
+
+def _restore_indexes(conn, indexes):
+    """Recreates any of the indexes that are missing after a failed load
+
+    Where DDL is transactional, rolling back the load already restored them,
+    but SQLite's driver runs the statements dropping them outside of the
+    transaction. Every index is attempted, even if some can't be recreated.
+
+    """
+    inspector = sqlalchemy.inspect(conn)
+    existing = {}
+    for index in indexes:
+        table = index.table
+        if table not in existing:
+            existing[table] = set(i['name'] for i in inspector.get_indexes(table.name, schema=table.schema))
+        if index.name in existing[table]:
+            continue
+        try:
+            with conn.begin():
+                index.create(bind=conn)
+        except Exception:
+            log.exception("Could not recreate index '{0}' on '{1}'".format(index.name, table.name))
+
+
+def dump_fixtures(db, filename, tables=(), models=(), batch_size=1000):
+    """Dumps the given tables and/or models from the database to a fixtures file.
+
+    The format of the file is picked from its extension, just as when loading
+    fixtures, and the resulting file can be loaded with
+    `load_fixtures_from_file`. Rows are read through a server-side cursor (on
+    databases that support one) and written out in batches of `batch_size`, so
+    memory use stays the same regardless of the size of the tables. If neither
+    tables nor models are given, every table in the database's metadata is
+    dumped in dependency order.
+
+    """
+    conn = db.engine.connect()
+    try:
+        loaders.dump(_read_fixtures(db, conn, tables, models, batch_size), filename)
+    finally:
+        conn.close()
+
+
+def _read_fixtures(db, conn, tables, models, batch_size):
+    """Yields a fixture, with a generator of records, for each table and model
+    """
+    if not tables and not models:
+        tables = [table.name for table in db.metadata.sorted_tables]
+
+    for name in tables:
+        table = db.metadata.tables.get(name)
+        if table is None:
+            table = Table(name, MetaData(), autoload_with=conn)
+        yield {'table': name, 'records': _read_records(conn, table.select(), None, batch_size)}
+
+    for name in models:
+        model = _import_model(name)
+        # Records are passed to the model's constructor when loading, so they
+        # need to be keyed by attribute name rather than column name
+        keys = dict((attr.columns[0].name, attr.key) for attr in sqlalchemy.inspect(model).column_attrs)
+        yield {'model': name, 'records': _read_records(conn, model.__table__.select(), keys, batch_size)}
+
+
+def _read_records(conn, query, keys, batch_size):
+    """Yields each row returned by the query as a dict
+    """
+    result = conn.execution_options(stream_results=True).execute(query)
+    try:
+        columns = list(result.keys())
+        if keys is not None:
+            columns = [keys.get(column) for column in columns]
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict((c, v) for c, v in zip(columns, row) if c is not None)
+    finally:
+        result.close()
+
+
 class MetaFixturesMixin(type):
     def __new__(meta, name, bases, attrs):
 
@@ -257,3 +632,5 @@ class FixturesMixin(six.with_metaclass(MetaFixturesMixin, object)):
     fixtures = None
     app = None
     db = None
+    use_request_context = True
+    defer_constraints = False
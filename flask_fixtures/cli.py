@@ -0,0 +1,44 @@
+"""
+    flask_fixtures.cli
+    ~~~~~~~~~~~~~~~~~~
+
+    The `flask fixtures` command line interface.
+
+    :copyright: (c) 2015 Christopher Roach <ask.croach@gmail.com>.
+    :license: MIT, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import dump_fixtures
+
+
+@click.group('fixtures')
+def fixtures():
+    """Create and manage fixtures."""
+
+
+@fixtures.command('dump')
+@click.option('--table', '-t', 'tables', multiple=True,
+              help='Name of a table to dump. May be given more than once.')
+@click.option('--model', '-m', 'models', multiple=True,
+              help='Fully-qualified class name of a model to dump. May be given more than once.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Number of rows to read from the database at a time.')
+@click.argument('filename')
+@with_appcontext
+def dump(filename, tables, models, batch_size):
+    """Dumps data from the app's database to a fixtures file.
+
+    The format of FILENAME is picked from its extension (e.g., .json, .yaml,
+    or .pickle). If no tables or models are given, all tables are dumped.
+    """
+    state = current_app.extensions.get('sqlalchemy')
+    if state is None:
+        raise click.ClickException('No Flask-SQLAlchemy database is registered on the app.')
+    # Flask-SQLAlchemy < 3.0 registers a state object holding the db instead
+    db = getattr(state, 'db', state)
+    dump_fixtures(db, filename, tables, models, batch_size)
@@ -10,11 +10,19 @@
 from __future__ import absolute_import
 
 import abc
+import contextlib
+import datetime
+import decimal
+import hashlib
+import itertools
+import mmap
 import os
 import logging
+import tempfile
 
 from .utils import print_info
 import six
+from six.moves import cPickle as pickle
 
 try:
     from dateutil.parser import parse as dtparse
@@ -22,62 +30,276 @@ except ImportError:
     print_info("""If you are using JSON for your fixtures, consider installing
         the dateutil library for more flexible parsing of dates and times.""")
 
-    from datetime import datetime
+    # The formats written by datetime.isoformat(), which is used when dumping
+    # fixtures to JSON, along with plain dates
+    DATETIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f')
+
     def dtparse(dtstring):
         """Returns a datetime object for the given string"""
-        return datetime.strptime(dtstring, '%Y-%m-%d')
+        for fmt in DATETIME_FORMATS[:-1]:
+            try:
+                return datetime.datetime.strptime(dtstring, fmt)
+            except ValueError:
+                pass
+        return datetime.datetime.strptime(dtstring, DATETIME_FORMATS[-1])
 
 try:
     import simplejson as json
 except ImportError:
     import json
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 try:
     import yaml
 except ImportError:
-    def load(self, filename):
+    def load(self, filename, *args, **kwargs):
         raise Exception("Could not load fixture '{0}'. Make sure you have PyYAML installed.".format(filename))
+    def dump(self, data, *args, **kwargs):
+        raise Exception("Could not dump fixtures. Make sure you have PyYAML installed.")
     yaml = type('FakeYaml', (object,), {
-        'load': load
+        'load': load,
+        'dump': dump,
+        'Loader': None
     })()
+    YAMLDumper = None
+    YAMLTagLoader = None
+else:
+    # Neither decimals nor times have a YAML type of their own, so they're
+    # dumped with explicit tags. Strings are never guessed to be times.
+    class YAMLDumper(yaml.SafeDumper):
+        """Dumps decimals and times, which the safe dumper can't represent, as tagged strings
+        """
+    # SQLAlchemy's names are a subclass of str, which the safe dumper rejects
+    YAMLDumper.add_multi_representer(six.text_type, YAMLDumper.represent_str if six.PY3 else YAMLDumper.represent_unicode)
+    YAMLDumper.add_representer(decimal.Decimal, lambda dumper, value: dumper.represent_scalar('!decimal', str(value)))
+    YAMLDumper.add_representer(datetime.time, lambda dumper, value: dumper.represent_scalar('!time', value.isoformat()))
+
+    class YAMLTagLoader(yaml.Loader):
+        """Loads the decimals and times tagged by the YAMLDumper
+        """
+    YAMLTagLoader.add_constructor('!decimal', lambda loader, node: decimal.Decimal(loader.construct_scalar(node)))
+    YAMLTagLoader.add_constructor('!time', lambda loader, node: parse_time(loader.construct_scalar(node)))
 
 
 log = logging.getLogger(__name__)
 
 
+# The formats written by time.isoformat()
+TIME_FORMATS = ('%H:%M:%S', '%H:%M:%S.%f')
+
+
+def parse_time(value):
+    """Returns a time object for the given string"""
+    for fmt in TIME_FORMATS[:-1]:
+        try:
+            return datetime.datetime.strptime(value, fmt).time()
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(value, TIME_FORMATS[-1]).time()
+
+
+# Fixtures tend to repeat the same values (status codes, names, dates, etc.)
+# across many records. Values of these types are immutable, so all equal
+# occurrences within a file can safely share a single object.
+SHARED_VALUE_TYPES = six.string_types + (datetime.date, datetime.time)
+
+
+def dedupe(data, memo=None):
+    """Returns the data with equal strings and dates replaced by one shared copy
+
+    Walks the lists and dicts in the given data, replacing every string key
+    and every string or date value with the first equal object seen, so that
+    repeated values only take up memory once.
+
+    """
+    if memo is None:
+        memo = {}
+    if isinstance(data, dict):
+        return dict((memo.setdefault(k, k) if isinstance(k, six.string_types) else k, dedupe(v, memo))
+                    for k, v in data.items())
+    if isinstance(data, list):
+        return [dedupe(v, memo) for v in data]
+    if isinstance(data, SHARED_VALUE_TYPES):
+        return memo.setdefault(data, data)
+    return data
+
+
+def _header(fixture):
+    """Returns the fixture without its records, i.e., its model or table"""
+    return dict((k, v) for k, v in fixture.items() if k != 'records')
+
+
 class FixtureLoader(six.with_metaclass(abc.ABCMeta, object)):
+
+    # Part of the key for cached fixtures (see `load`), so bump this whenever
+    # a change to a loader changes the data it returns
+    version = 1
+
     @abc.abstractmethod
     def load(self):
         pass
 
+    def dump(self, fixtures, filename):
+        """Writes the fixtures to the given file.
+
+        The records of each fixture may be any iterable (e.g., a generator
+        reading rows from a database), and loaders should write them out as
+        they go rather than holding them all in memory.
+
+        """
+        raise NotImplementedError("The loader '{0}' does not support dumping fixtures.".format(type(self).__name__))
+
 
 class JSONLoader(FixtureLoader):
+    """Reads and writes fixtures as JSON.
+
+    JSON has no types for dates, times, or decimals. Dates and datetimes are
+    written as strings and, as in any JSON fixtures, strings are parsed as
+    datetimes wherever possible. Times and decimals are written as tagged
+    objects, e.g., ``{"__time__": "12:30:00"}``, which are turned back into
+    times and decimals when loaded.
+
+    """
 
     extensions = ('.json', '.js')
 
+    version = 3
+
+    # The tagged objects used for values with no JSON type of their own
+    TAGS = {
+        '__time__': parse_time,
+        '__decimal__': decimal.Decimal,
+    }
+
     def load(self, filename):
+        # Maps each distinct string value to either its parsed datetime or a
+        # single shared copy of the string, so each one is only parsed once.
+        # The JSON decoder already shares repeated keys within a document.
+        values = {}
+
         def _datetime_parser(dct):
+            if len(dct) == 1:
+                tag, value = list(dct.items())[0]
+                if tag in self.TAGS:
+                    return self.TAGS[tag](value)
             for key, value in list(dct.items()):
-                try:
-                    dct[key] = dtparse(value)
-                except Exception:
-                    pass
+                if not isinstance(value, six.string_types):
+                    continue
+                if value not in values:
+                    try:
+                        values[value] = dtparse(value)
+                    except Exception:
+                        values[value] = value
+                dct[key] = values[value]
             return dct
 
         with open(filename) as fin:
             return json.load(fin, object_hook=_datetime_parser)
 
+    def dump(self, fixtures, filename):
+        def _default(obj):
+            if isinstance(obj, datetime.time):
+                return {'__time__': obj.isoformat()}
+            if isinstance(obj, datetime.date):
+                return obj.isoformat()
+            if isinstance(obj, decimal.Decimal):
+                return {'__decimal__': str(obj)}
+            raise TypeError("{0!r} is not JSON serializable".format(obj))
+
+        options = {'default': _default}
+        if json.__name__ == 'simplejson':
+            # Otherwise simplejson writes decimals as plain numbers
+            options['use_decimal'] = False
+
+        with open(filename, 'w') as fout:
+            fout.write('[')
+            for i, fixture in enumerate(fixtures):
+                # Write the header without its closing brace, so the records
+                # can be streamed into the same object one at a time
+                fout.write(',\n' if i else '\n')
+                fout.write(json.dumps(_header(fixture), **options)[:-1])
+                fout.write(', "records": [')
+                for j, record in enumerate(fixture['records']):
+                    fout.write(',\n    ' if j else '\n    ')
+                    fout.write(json.dumps(record, **options))
+                fout.write('\n]}')
+            fout.write('\n]\n')
+
 
 class YAMLLoader(FixtureLoader):
 
     extensions = ('.yaml', '.yml')
 
+    version = 3
+
     def load(self, filename):
         with open(filename) as fin:
-            return yaml.load(fin)
+            return dedupe(yaml.load(fin, Loader=YAMLTagLoader))
+
+    def dump(self, fixtures, filename):
+        with open(filename, 'w') as fout:
+            empty = True
+            for fixture in fixtures:
+                empty = False
+                fout.write(yaml.dump([_header(fixture)], Dumper=YAMLDumper, default_flow_style=False))
+                fout.write('  records:')
+                # Write each record on a single line as it comes in
+                count = 0
+                for count, record in enumerate(fixture['records'], 1):
+                    line = yaml.dump(record, Dumper=YAMLDumper, default_flow_style=True, width=float('inf'))
+                    fout.write('\n  - {0}'.format(line.strip()))
+                fout.write('\n' if count else ' []\n')
+            if empty:
+                fout.write('[]\n')
+
 
+class PickleLoader(FixtureLoader):
+    """Reads and writes fixtures as a compact binary stream of pickles.
 
-def load(filename):
+    Each fixture is written as a header (the fixture without its records)
+    followed by its records in batches of `batch_size`, so that fixtures of
+    any size can be written and read back one batch at a time.
+
+    """
+
+    extensions = ('.pickle', '.pkl')
+
+    batch_size = 1000
+
+    def load(self, filename):
+        fixtures = []
+        memo = {}
+        with open(filename, 'rb') as fin:
+            while True:
+                try:
+                    frame = pickle.load(fin)
+                except EOFError:
+                    break
+                if isinstance(frame, dict):
+                    frame['records'] = []
+                    fixtures.append(frame)
+                else:
+                    fixtures[-1]['records'].extend(dedupe(frame, memo))
+        return fixtures
+
+    def dump(self, fixtures, filename):
+        with open(filename, 'wb') as fout:
+            for fixture in fixtures:
+                pickle.dump(_header(fixture), fout, pickle.HIGHEST_PROTOCOL)
+                records = iter(fixture['records'])
+                while True:
+                    batch = list(itertools.islice(records, self.batch_size))
+                    if not batch:
+                        break
+                    pickle.dump(batch, fout, pickle.HIGHEST_PROTOCOL)
+
+
+def get_loader(filename):
+    """Returns the loader for the given file, or None if there isn't one"""
     name, extension = os.path.splitext(filename)
 
     for cls in FixtureLoader.__subclasses__():
@@ -90,10 +312,159 @@ def load(filename):
         # Otherwise, check if the file's extension matches a loader extension
         for ext in cls.extensions:
             if extension == ext:
-                return cls().load(filename)
+                return cls()
+
+    return None
+
+
+def load(filename, cache_dir=None):
+    """Returns the fixtures in the given file.
+
+    If a `cache_dir` is given, the parsed fixtures are stored there, keyed by
+    a hash of the file's contents and the loader's version, and later loads
+    of the same file (from any process) are read from the cache instead of
+    parsing the file again.
+
+    """
+    loader = get_loader(filename)
+    if loader is None:
+        # None of the loaders matched, so raise an exception
+        raise Exception("Could not load fixture '{0}'. Unsupported file format.".format(filename))
+    if cache_dir is None:
+        return loader.load(filename)
+    return _load_cached(loader, filename, cache_dir)
+
+
+def _cache_key(loader, filename):
+    """Returns the key for the parsed contents of the file in the cache"""
+    # Besides the file itself, the parsed data depends on the loader, on which
+    # date parser is installed, and on the pickle protocol used to store it
+    digest = hashlib.sha256()
+    digest.update('{0}.{1}:{2}:{3}:{4}\n'.format(
+        type(loader).__module__, type(loader).__name__, loader.version,
+        dtparse.__module__, pickle.HIGHEST_PROTOCOL).encode('utf-8'))
+    with open(filename, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def _lock(filename):
+    """Holds an exclusive lock on the given file, where supported"""
+    try:
+        fout = open(filename, 'a')
+    except (IOError, OSError):
+        log.warning("Could not open fixtures cache lock file '{0}'.".format(filename), exc_info=True)
+        yield
+        return
+    with fout:
+        if fcntl is not None:
+            fcntl.flock(fout, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fout, fcntl.LOCK_UN)
+
+
+# Returned by _read_cache when there's no usable entry in the cache
+_CACHE_MISS = object()
+
+
+def _read_cache(filename):
+    """Returns the fixtures in the cache file, or _CACHE_MISS if there aren't any
+
+    Any error while reading the file counts as a miss, so that an empty,
+    truncated, or otherwise corrupt entry gets rebuilt rather than breaking
+    every later load.
+
+    """
+    try:
+        with open(filename, 'rb') as fin:
+            # Mapping the file lets pickle read it without first copying it
+            # into a buffer; the fixtures it returns are still ordinary
+            # objects private to this process
+            mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return pickle.load(mapped)
+            finally:
+                mapped.close()
+    except Exception:
+        if os.path.exists(filename):
+            log.warning("Ignoring unreadable fixtures cache file '{0}'.".format(filename), exc_info=True)
+        return _CACHE_MISS
+
+
+def _write_cache(filename, fixtures):
+    """Writes the fixtures to the cache file"""
+    # Write to a temporary file and move it into place, so that the cache
+    # file is never seen half written
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            pickle.dump(fixtures, fout, pickle.HIGHEST_PROTOCOL)
+        getattr(os, 'replace', os.rename)(tmp_filename, filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+
+
+def _load_cached(loader, filename, cache_dir):
+    try:
+        os.makedirs(cache_dir)
+    except OSError:
+        if not os.path.isdir(cache_dir):
+            log.warning("Could not create fixtures cache directory '{0}'.".format(cache_dir), exc_info=True)
+            return loader.load(filename)
+
+    cache_filename = os.path.join(cache_dir, _cache_key(loader, filename) + '.pickle')
+    fixtures = _read_cache(cache_filename)
+    if fixtures is not _CACHE_MISS:
+        return fixtures
+
+    # Only one process builds each cache file, the rest wait for it and then
+    # read the result from the cache
+    lock_filename = cache_filename + '.lock'
+    with _lock(lock_filename):
+        fixtures = _read_cache(cache_filename)
+        if fixtures is not _CACHE_MISS:
+            return fixtures
+
+        fixtures = loader.load(filename)
+
+        # Failing to cache the fixtures shouldn't fail loading them
+        try:
+            _write_cache(cache_filename, fixtures)
+        except Exception:
+            log.warning("Could not write fixtures cache file '{0}'.".format(cache_filename), exc_info=True)
+        else:
+            # Any process waiting on the lock reads the cache file we just
+            # wrote once it gets the lock, so the lock file can go now rather
+            # than piling up in the cache directory
+            try:
+                os.remove(lock_filename)
+            except OSError:
+                pass
+        return fixtures
+
+
+def dump(fixtures, filename):
+    loader = get_loader(filename)
+    if loader is None:
+        raise Exception("Could not dump fixtures to '{0}'. Unsupported file format.".format(filename))
 
-    # None of the loaders matched, so raise an exception
-    raise Exception("Could not load fixture '{0}'. Unsupported file format.".format(filename))
+    # Dump to a temporary file and move it into place, so that a failed dump
+    # never leaves a half written fixtures file behind
+    directory, name = os.path.split(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(dir=directory, prefix=name + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        loader.dump(fixtures, tmp_filename)
+        getattr(os, 'replace', os.rename)(tmp_filename, filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
 
 
 def extensions():
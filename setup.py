@@ -48,6 +48,11 @@ setup(
     # of py_modules:
     install_requires=install_requires,
     packages=['flask_fixtures'],
+    entry_points={
+        'flask.commands': [
+            'fixtures = flask_fixtures.cli:fixtures'
+        ]
+    },
     zip_safe=False,
     include_package_data=True,
     platforms='any',
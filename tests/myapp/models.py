@@ -14,7 +14,7 @@ db.init_app(app)
 class Author(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(30))
-    last_name = db.Column(db.String(30))
+    last_name = db.Column(db.String(30), index=True)
 
 class Book(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -22,3 +22,9 @@ class Book(db.Model):
     published_date = db.Column(db.DateTime)
     author_id = db.Column(db.Integer, db.ForeignKey('author.id'))
     author = db.relationship('Author', backref='books')
+
+class Signing(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(10), unique=True, index=True)
+    starts_at = db.Column(db.Time)
+    ticket_price = db.Column(db.Numeric(10, 2))
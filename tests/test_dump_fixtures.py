@@ -0,0 +1,101 @@
+"""
+    test_dump_fixtures
+    ~~~~~~~~~~~~~~~~~~
+
+    A set of tests that check that fixtures dumped from the database can be
+    loaded back into it.
+
+    :copyright: (c) 2015 Christopher Roach <ask.croach@gmail.com>.
+    :license: MIT, see LICENSE for more details.
+"""
+
+
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from myapp import app
+from myapp.models import db, Book, Author, Signing
+
+from flask_fixtures import dump_fixtures, load_fixtures_from_file, push_ctx, pop_ctx
+
+# Configure the app with the testing configuration
+app.config.from_object('myapp.config.TestConfig')
+fixtures_dirs = [os.path.join(app.root_path, 'fixtures')]
+
+
+class TestDumpFixtures(unittest.TestCase):
+    def setUp(self):
+        push_ctx(app)
+        db.create_all()
+        db.session.rollback()
+        load_fixtures_from_file(db, 'authors.json', fixtures_dirs)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        db.session.expunge_all()
+        db.drop_all()
+        pop_ctx()
+
+    def reload(self, filename):
+        db.session.expunge_all()
+        db.drop_all()
+        db.create_all()
+        load_fixtures_from_file(db, filename)
+
+    def check_round_trip(self, extension, **kwargs):
+        filename = os.path.join(self.tmpdir, 'dump' + extension)
+        dump_fixtures(db, filename, batch_size=2, **kwargs)
+        self.reload(filename)
+        assert Author.query.count() == 1
+        assert Book.query.count() == 3
+        titles = [b.title for b in Book.query.order_by(Book.id)]
+        assert titles == ['Neuromancer', 'Count Zero', 'Mona Lisa Overdrive']
+        assert Book.query.first().author.last_name == 'Gibson'
+
+    def test_dump_json(self):
+        self.check_round_trip('.json')
+
+    def test_dump_pickle(self):
+        self.check_round_trip('.pickle')
+        assert Book.query.first().published_date.year == 1984
+
+    def test_dump_yaml(self):
+        self.check_round_trip('.yaml')
+
+    def check_decimal_and_time_round_trip(self, extension):
+        starts_at = datetime.time(12, 30)
+        db.session.add(Signing(starts_at=starts_at, ticket_price=decimal.Decimal('0.10')))
+        db.session.commit()
+        filename = os.path.join(self.tmpdir, 'dump' + extension)
+        dump_fixtures(db, filename, tables=['signing'])
+        self.reload(filename)
+        signing = Signing.query.one()
+        assert signing.starts_at == starts_at
+        assert signing.ticket_price == decimal.Decimal('0.10')
+
+    def test_dump_json_decimal_and_time(self):
+        self.check_decimal_and_time_round_trip('.json')
+
+    def test_dump_yaml_decimal_and_time(self):
+        self.check_decimal_and_time_round_trip('.yaml')
+
+    def test_dump_tables_and_models(self):
+        self.check_round_trip('.pickle', tables=['author'], models=['myapp.models.Book'])
+
+    def test_dump_cli(self):
+        if not hasattr(app, 'test_cli_runner'):
+            return
+        from flask_fixtures.cli import fixtures
+        filename = os.path.join(self.tmpdir, 'dump.pickle')
+        result = app.test_cli_runner().invoke(fixtures, ['dump', '--table', 'author', filename])
+        assert result.exit_code == 0, result.output
+        self.reload(filename)
+        assert Author.query.count() == 1
+        assert Book.query.count() == 0
@@ -136,3 +136,30 @@ if hasattr(app, 'app_context'):
         def tearDown(self):
             super(TestMyAppWithAppContext, self).tearDown()
             self.ctx.pop()
+
+
+class TestMyAppWithoutRequestContext(TestMyAppWithUserDefinedFunctions):
+    """Tests that fixtures work when only an app context is pushed.
+    """
+
+    use_request_context = False
+
+    def test_no_request_context(self):
+        from flask import has_request_context
+        assert not has_request_context()
+
+
+if hasattr(app, 'app_context'):
+    class TestPushCtxReusesAppContext(unittest.TestCase):
+        """Tests that push_ctx reuses an app context that is already in place.
+        """
+
+        def test_reuse_app_context(self):
+            from flask import g
+            from flask_fixtures import push_ctx, pop_ctx
+            with app.app_context():
+                g.marker = 'outer'
+                push_ctx(app, use_request_context=False)
+                assert g.marker == 'outer'
+                pop_ctx()
+                assert g.marker == 'outer'
@@ -3,10 +3,12 @@ from __future__ import absolute_import
 import os
 import unittest
 
+import sqlalchemy
+
 from myapp import app
-from myapp.models import db, Book, Author
+from myapp.models import db, Book, Author, Signing
 
-from flask_fixtures import load_fixtures_from_file, push_ctx, pop_ctx
+from flask_fixtures import load_fixtures, load_fixtures_from_file, select_fixtures, push_ctx, pop_ctx
 
 # Configure the app with the testing configuration
 app.config.from_object('myapp.config.TestConfig')
@@ -39,3 +41,168 @@ class TestLoadFixturesFromFile(unittest.TestCase):
         load_fixtures_from_file(db, 'authors.yaml', fixtures_dirs)
         assert Author.query.count() == 1
         assert Book.query.count() == 3
+
+    def test_load_fixtures_spec_model(self):
+        load_fixtures_from_file(db, {'file': 'authors.json', 'table': 'author'}, fixtures_dirs)
+        assert Author.query.count() == 1
+        assert Book.query.count() == 0
+
+    def test_load_fixtures_spec_where(self):
+        spec = {
+            'file': 'authors.json',
+            'where': lambda record: record.get('title', 'Count Zero') == 'Count Zero',
+        }
+        load_fixtures_from_file(db, spec, fixtures_dirs)
+        assert Author.query.count() == 1
+        assert [b.title for b in Book.query.all()] == ['Count Zero']
+
+    def test_load_fixtures_spec_limit(self):
+        load_fixtures_from_file(db, {'file': 'authors.json', 'limit': 2}, fixtures_dirs)
+        assert Author.query.count() == 1
+        assert [b.title for b in Book.query.all()] == ['Neuromancer', 'Count Zero']
+
+    def test_load_fixtures_spec_sample(self):
+        spec = {'file': 'authors.json', 'model': 'myapp.models.Book', 'sample': 2, 'seed': 1}
+        load_fixtures_from_file(db, spec, fixtures_dirs)
+        titles = [b.title for b in Book.query.all()]
+        assert len(titles) == 2
+        all_titles = ['Neuromancer', 'Count Zero', 'Mona Lisa Overdrive']
+        assert titles == [t for t in all_titles if t in titles]
+
+    def test_load_fixtures_spec_unknown_field(self):
+        with self.assertRaises(ValueError):
+            load_fixtures_from_file(db, {'file': 'authors.json', 'rows': 2}, fixtures_dirs)
+
+    def test_load_fixtures_spec_limit_and_sample(self):
+        with self.assertRaises(ValueError):
+            load_fixtures_from_file(db, {'file': 'authors.json', 'limit': 2, 'sample': 2}, fixtures_dirs)
+
+    def test_load_fixtures_spec_validated_before_reading(self):
+        # The file doesn't exist, so a ValueError means the spec was
+        # rejected before looking for it
+        with self.assertRaises(ValueError):
+            load_fixtures_from_file(db, {'file': 'missing.json', 'rows': 2}, fixtures_dirs)
+        with self.assertRaises(ValueError):
+            select_fixtures([], {'file': 'authors.json', 'rows': 2})
+
+    def test_load_fixtures_defer_constraints(self):
+        load_fixtures_from_file(db, 'authors.json', fixtures_dirs, defer_constraints=True)
+        assert Author.query.count() == 1
+        assert Book.query.count() == 3
+        indexes = sqlalchemy.inspect(db.engine).get_indexes('author')
+        assert [index['name'] for index in indexes] == ['ix_author_last_name']
+
+    def test_load_fixtures_defer_constraints_violation(self):
+        fixtures = [{'table': 'book', 'records': [{'id': 1, 'title': 'Neuromancer', 'author_id': 2}]}]
+        with db.engine.connect() as conn:
+            conn.execute(sqlalchemy.text('PRAGMA foreign_keys=ON'))
+        try:
+            with self.assertRaises(ValueError):
+                load_fixtures(db, fixtures, defer_constraints=True)
+        finally:
+            with db.engine.connect() as conn:
+                conn.execute(sqlalchemy.text('PRAGMA foreign_keys=OFF'))
+        assert Book.query.count() == 0
+        indexes = sqlalchemy.inspect(db.engine).get_indexes('author')
+        assert [index['name'] for index in indexes] == ['ix_author_last_name']
+
+    def test_load_fixtures_defer_constraints_unique_violation(self):
+        fixtures = [{'table': 'signing', 'records': [{'id': 1, 'code': 'A'}, {'id': 2, 'code': 'A'}]}]
+        with db.engine.connect() as conn:
+            conn.execute(sqlalchemy.text('PRAGMA foreign_keys=ON'))
+        try:
+            with self.assertRaises(ValueError):
+                load_fixtures(db, fixtures, defer_constraints=True)
+            with db.engine.connect() as conn:
+                assert conn.execute(sqlalchemy.text('PRAGMA foreign_keys')).scalar() == 1
+        finally:
+            with db.engine.connect() as conn:
+                conn.execute(sqlalchemy.text('PRAGMA foreign_keys=OFF'))
+        assert Signing.query.count() == 0
+        indexes = sqlalchemy.inspect(db.engine).get_indexes('signing')
+        assert [index['name'] for index in indexes] == ['ix_signing_code']
+
+
+class TestSyncSequences(unittest.TestCase):
+    """Checks the statement used to move PostgreSQL sequences past the keys
+    loaded from fixtures, since there's no PostgreSQL database to test with.
+    """
+
+    class Connection(object):
+        def __init__(self, dialect):
+            self.dialect = dialect
+            self.statements = []
+
+        def execute(self, statement, params):
+            self.statements.append((str(statement), params))
+
+    def test_sync_sequences_postgresql(self):
+        from sqlalchemy.dialects import postgresql
+        from flask_fixtures import _max_keys_for, _sync_sequences, _track_max_key
+        conn = self.Connection(postgresql.dialect())
+        max_keys = _max_keys_for(conn)
+        for key in (3, 7, None, 5):
+            _track_max_key(max_keys, Author.__table__, key)
+        _sync_sequences(conn, max_keys)
+        assert len(conn.statements) == 1
+        statement, params = conn.statements[0]
+        assert statement.count('setval') == 1
+        assert params == {'table_0': 'author', 'column_0': 'id', 'value_0': 7}
+
+    def test_sync_sequences_two_loads(self):
+        # Loading ids 1..10 and then 5..6 into the same table must never
+        # move the sequence back below the ids already in the table
+        from sqlalchemy.dialects import postgresql
+        from flask_fixtures import _max_keys_for, _sync_sequences, _track_max_key
+        conn = self.Connection(postgresql.dialect())
+        for keys in (range(1, 11), range(5, 7)):
+            max_keys = _max_keys_for(conn)
+            for key in keys:
+                _track_max_key(max_keys, Author.__table__, key)
+            _sync_sequences(conn, max_keys)
+        statement, params = conn.statements[1]
+        assert params['value_0'] == 6
+        assert 'GREATEST(:value_0, (SELECT COALESCE(MAX(id), 0) FROM author))' in statement
+
+    def test_sync_sequences_ignores_keys_below_one(self):
+        from sqlalchemy.dialects import postgresql
+        from flask_fixtures import _max_keys_for, _sync_sequences, _track_max_key
+        conn = self.Connection(postgresql.dialect())
+        max_keys = _max_keys_for(conn)
+        for key in (0, -3):
+            _track_max_key(max_keys, Author.__table__, key)
+        _sync_sequences(conn, max_keys)
+        assert conn.statements == []
+
+    def test_sync_sequences_sqlite(self):
+        from sqlalchemy.dialects import sqlite
+        from flask_fixtures import _max_keys_for
+        assert _max_keys_for(self.Connection(sqlite.dialect())) is None
+
+
+class TestTrackMaxKeys(unittest.TestCase):
+    """Checks that tracking the largest keys doesn't consume the records.
+    """
+
+    def setUp(self):
+        push_ctx(app)
+        db.create_all()
+        db.session.rollback()
+
+    def tearDown(self):
+        db.session.expunge_all()
+        db.drop_all()
+        pop_ctx()
+
+    def test_track_max_keys_with_generators(self):
+        from flask_fixtures import _insert_fixtures
+        fixtures = [
+            {'table': 'author', 'records': (r for r in [{'id': 4, 'first_name': 'William'}])},
+            {'model': 'myapp.models.Book', 'records': (r for r in [{'id': 9, 'title': 'Neuromancer'}])},
+        ]
+        max_keys = {}
+        with db.engine.connect() as conn:
+            _insert_fixtures(db.metadata, conn, db.session, fixtures, db.session.commit, max_keys)
+        assert Author.query.count() == 1
+        assert Book.query.count() == 1
+        assert max_keys == {Author.__table__: 4, Book.__table__: 9}
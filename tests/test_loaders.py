@@ -0,0 +1,142 @@
+"""
+    test_loaders
+    ~~~~~~~~~~~~
+
+    A set of tests for the fixtures loaders.
+
+    :copyright: (c) 2015 Christopher Roach <ask.croach@gmail.com>.
+    :license: MIT, see LICENSE for more details.
+"""
+
+
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask_fixtures import loaders
+
+
+class TestLoaders(unittest.TestCase):
+
+    def test_json_shares_repeated_values(self):
+        records = [{'status': 'active', 'published_date': '1984-07-01'}] * 2
+        fd, filename = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as fout:
+            json.dump([{'table': 'book', 'records': records}], fout)
+        try:
+            records = loaders.load(filename)[0]['records']
+        finally:
+            os.remove(filename)
+        assert isinstance(records[0]['published_date'], datetime.datetime)
+        assert records[0]['published_date'] is records[1]['published_date']
+        assert records[0]['status'] is records[1]['status']
+
+    def test_time_like_strings_stay_strings(self):
+        fd, filename = tempfile.mkstemp(suffix='.yaml')
+        with os.fdopen(fd, 'w') as fout:
+            fout.write("- table: author\n  records: [{id: 1, first_name: '10:15:00', last_name: Gibson}]\n")
+        try:
+            records = loaders.load(filename)[0]['records']
+        finally:
+            os.remove(filename)
+        assert records[0]['first_name'] == '10:15:00'
+
+    def test_dump_tags_times_and_decimals(self):
+        record = {'name': '10:15:00', 'starts_at': datetime.time(10, 15), 'price': decimal.Decimal('0.10')}
+        for extension in ('.json', '.yaml'):
+            fd, filename = tempfile.mkstemp(suffix=extension)
+            os.close(fd)
+            try:
+                loaders.dump([{'table': 'signing', 'records': [record]}], filename)
+                loaded = loaders.load(filename)[0]['records'][0]
+            finally:
+                os.remove(filename)
+            assert loaded['starts_at'] == datetime.time(10, 15)
+            assert loaded['price'] == decimal.Decimal('0.10')
+            assert not isinstance(loaded['name'], datetime.time)
+
+    def test_dedupe(self):
+        date = datetime.date(2015, 1, 1)
+        data = [{'status': ''.join(['act', 'ive']), 'created': date},
+                {'status': ''.join(['acti', 've']), 'created': datetime.date(2015, 1, 1)}]
+        data = loaders.dedupe(data)
+        assert data[0]['status'] is data[1]['status']
+        assert data[0]['created'] is data[1]['created'] is date
+        assert list(data[0].keys())[0] is list(data[1].keys())[0]
+
+
+class TestCachedLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.filename = os.path.join(self.tmpdir, 'books.json')
+        self.write([{'title': 'Neuromancer', 'published_date': '1984-07-01'}])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, records):
+        with open(self.filename, 'w') as fout:
+            json.dump([{'table': 'book', 'records': records}], fout)
+
+    def cache_files(self):
+        return [f for f in os.listdir(self.cache_dir) if f.endswith('.pickle')]
+
+    def test_load_from_cache(self):
+        fixtures = loaders.load(self.filename, self.cache_dir)
+        assert len(self.cache_files()) == 1
+
+        # Loading again should read the cache rather than parse the file
+        original_load = loaders.JSONLoader.load
+        loaders.JSONLoader.load = lambda loader, filename: self.fail('file was parsed again')
+        try:
+            assert loaders.load(self.filename, self.cache_dir) == fixtures
+        finally:
+            loaders.JSONLoader.load = original_load
+        record = fixtures[0]['records'][0]
+        assert record['published_date'] == datetime.datetime(1984, 7, 1)
+
+    def test_cache_keyed_by_content(self):
+        loaders.load(self.filename, self.cache_dir)
+        self.write([{'title': 'Count Zero', 'published_date': '1986-03-01'}])
+        fixtures = loaders.load(self.filename, self.cache_dir)
+        assert fixtures[0]['records'][0]['title'] == 'Count Zero'
+        assert len(self.cache_files()) == 2
+
+    def check_bad_cache_entry(self, contents):
+        loaders.load(self.filename, self.cache_dir)
+        cache_filename = os.path.join(self.cache_dir, self.cache_files()[0])
+        with open(cache_filename, 'wb') as fout:
+            fout.write(contents)
+        fixtures = loaders.load(self.filename, self.cache_dir)
+        assert fixtures[0]['records'][0]['title'] == 'Neuromancer'
+        # The bad entry should have been rebuilt
+        assert loaders._read_cache(cache_filename) == fixtures
+
+    def test_empty_cache_entry(self):
+        self.check_bad_cache_entry(b'')
+
+    def test_corrupt_cache_entry(self):
+        self.check_bad_cache_entry(b'\x80\x04not a pickle')
+
+    def test_cache_lock_removed(self):
+        loaders.load(self.filename, self.cache_dir)
+        assert not [f for f in os.listdir(self.cache_dir) if f.endswith('.lock')]
+
+    def test_cache_write_failure(self):
+        # Fixtures that can't be pickled can't be cached, but should still load
+        original_load = loaders.JSONLoader.load
+        unpicklable = [{'table': 'book', 'records': [{'title': lambda: None}]}]
+        loaders.JSONLoader.load = lambda loader, filename: unpicklable
+        try:
+            assert loaders.load(self.filename, self.cache_dir) is unpicklable
+        finally:
+            loaders.JSONLoader.load = original_load
+        assert not [f for f in os.listdir(self.cache_dir) if not f.endswith('.lock')]